@@ -35,6 +35,11 @@ from noble_logging_utils.papertrail_struct_logger import (
     SF_LOG_SANDBOX,
 )
 
+from .soql_query import (
+    build_query,
+    planned_query,
+)
+
 
 DAYS_BACK = 2 # convert objects from last DAYS_BACK days
 
@@ -94,21 +99,30 @@ def convert_activity_histories(sf_connection, start_date):
     :return: None
     :rtype: None
     """
-    ah_query = (
-        f"SELECT ( "
-            f"SELECT {ah_fields.ID} "
-            f",{ah_fields.SUBJECT} "
-            f",{ah_fields.CREATED_DATE} "
-            f",{ah_fields.WHO_ID} "
-            f",{ah_fields.DESCRIPTION} "
-            f"FROM {ah_fields.API_NAME} "
-            f"WHERE IsTask = True "
-            f"AND {ah_fields.OWNER_ID} = '{AC_ID}' "
-            f"AND {ah_fields.WHO_ID} != NULL "
-            f"AND {ah_fields.CREATED_DATE} >= {start_date} "
-            f"ORDER BY {ah_fields.WHO_ID}, {ah_fields.CREATED_DATE} ASC "
-        f") "
-        f"FROM Account WHERE Id = '{ROWECLARK_ACCOUNT_ID}' "
+    ah_subquery = build_query(
+        ah_fields.API_NAME,
+        [
+            ah_fields.ID,
+            ah_fields.SUBJECT,
+            ah_fields.CREATED_DATE,
+            ah_fields.WHO_ID,
+            ah_fields.DESCRIPTION,
+        ],
+        [
+            "IsTask = True",
+            f"{ah_fields.OWNER_ID} = '{AC_ID}'",
+            f"{ah_fields.WHO_ID} != NULL",
+            f"{ah_fields.CREATED_DATE} >= {start_date}",
+        ],
+        order_by=[ah_fields.WHO_ID, ah_fields.CREATED_DATE],
+    )
+    # ActivityHistory is only queryable as a lookup on its parent; explain
+    # only plans the outer Account Id lookup and can't see the subquery
+    # filters, so this query isn't run through planned_query
+    ah_query = build_query(
+        "Account",
+        [f"({ah_subquery.strip()})"],
+        [f"Id = '{ROWECLARK_ACCOUNT_ID}'"],
     )
     # lookup query results are nested..
     ah_results = next(salesforce_gen(sf_connection, ah_query))
@@ -236,16 +250,26 @@ def convert_events(sf_connection, start_datestr):
     :return: None
     :rtype: None
     """
-    events_query = (
-        f"SELECT {event_fields.ID} "
-        f",{event_fields.WHO_ID} " # --> Contact__c
-        f",{event_fields.SUBJECT} " # --> Subject__c
-        f",{event_fields.DESCRIPTION} " # --> Comments__c
-        f",{event_fields.START_DATETIME} " # --> Date_of_Contact__c
-        f"FROM {event_fields.API_NAME} "
-        f"WHERE {event_fields.CREATED_DATE} >= {start_datestr} "
-        f"AND {event_fields.WHO_ID} != NULL "
-        f"AND OwnerId = '{AC_ID}' "
+    def make_events_query(date_filters):
+        return build_query(
+            event_fields.API_NAME,
+            [
+                event_fields.ID,
+                event_fields.WHO_ID, # --> Contact__c
+                event_fields.SUBJECT, # --> Subject__c
+                event_fields.DESCRIPTION, # --> Comments__c
+                event_fields.START_DATETIME, # --> Date_of_Contact__c
+            ],
+            date_filters + [
+                f"{event_fields.WHO_ID} != NULL",
+                f"OwnerId = '{AC_ID}'",
+            ],
+            order_by=[event_fields.CREATED_DATE],
+        )
+
+    events_query = planned_query(
+        sf_connection, logger, make_events_query, event_fields.CREATED_DATE,
+        start_datestr,
     )
 
     event_ids = []
@@ -0,0 +1,178 @@
+"""
+activity_history_conversion/src/soql_query.py
+
+Build SOQL queries for the conversion jobs.
+
+The first time a query shape is run, its plan is checked against the
+query-plan (explain) endpoint, both as written and with an added filter on an
+indexed audit date field. The cheapest variant is cached per query shape and
+reused for later runs on the same container.
+"""
+
+
+SYSTEM_MODSTAMP = "SystemModstamp"
+LAST_MODIFIED_DATE = "LastModifiedDate"
+# indexed on every object; always >= CreatedDate, so adding a filter on one
+# alongside the CreatedDate filter never changes the result set
+INDEXED_DATE_FIELDS = (SYSTEM_MODSTAMP, LAST_MODIFIED_DATE)
+
+# query plan relativeCost above which Salesforce treats a query as non-selective
+SELECTIVE_COST_THRESHOLD = 1.0
+
+START_DATE_PLACEHOLDER = ":start_date"
+
+# query shape -> indexed date field to filter on (None for no added filter)
+_plan_cache = {}
+
+
+def build_query(api_name, fields, filters, order_by=None):
+    """Build a SOQL SELECT statement.
+
+    :param api_name: str API name of the object to query
+    :param fields: iterable of str field names for the projection, eg. from
+        the object's ``salesforce_fields`` module
+    :param filters: iterable of str conditions, joined with AND
+    :param order_by: (optional) iterable of str field names to sort by,
+        ascending
+    :return: SOQL query
+    :rtype: str
+    """
+    query = f"SELECT {', '.join(fields)} FROM {api_name} "
+    if filters:
+        query += f"WHERE {' AND '.join(filters)} "
+    if order_by:
+        query += f"ORDER BY {', '.join(order_by)} ASC "
+
+    return query
+
+
+def planned_query(sf_connection, logger, make_query, date_field, start_date):
+    """Build a query using the cached plan for its shape, checking the plan
+    with the explain endpoint if this shape hasn't been seen yet.
+
+    :param sf_connection: ``simple_salesforce.Salesforce`` connection
+    :param logger: structlog logger to log plan costs to
+    :param make_query: func taking a list of str date filter conditions and
+        returning the full SOQL query
+    :param date_field: str name of the date field the query must filter on,
+        eg. CreatedDate
+    :param start_date: str earliest date, in SALESFORCE_DATETIME_FORMAT
+        (%Y-%m-%dT%H:%M:%S.%f%z)
+    :return: SOQL query
+    :rtype: str
+    """
+    shape = make_query(
+        _date_filters(date_field, None, START_DATE_PLACEHOLDER)
+    )
+    if shape not in _plan_cache:
+        indexed_field = _choose_indexed_field(
+            sf_connection, logger, make_query, date_field, start_date
+        )
+        if indexed_field is False:
+            # couldn't get a plan; run as written and check again next time
+            return make_query(_date_filters(date_field, None, start_date))
+        _plan_cache[shape] = indexed_field
+
+    return make_query(
+        _date_filters(date_field, _plan_cache[shape], start_date)
+    )
+
+
+def _date_filters(date_field, indexed_field, start_date):
+    """Make the list of date filter conditions for a query.
+
+    :param date_field: str name of the date field the query must filter on
+    :param indexed_field: str name of an indexed date field to also filter
+        on, or None
+    :param start_date: str earliest date, or placeholder
+    :return: list of str conditions
+    :rtype: list
+    """
+    filters = [f"{date_field} >= {start_date}"]
+    if indexed_field:
+        filters.append(f"{indexed_field} >= {start_date}")
+
+    return filters
+
+
+def _choose_indexed_field(sf_connection, logger, make_query, date_field,
+                          start_date):
+    """Explain the query as written and with each of INDEXED_DATE_FIELDS
+    added as a filter, and return the cheapest option.
+
+    Logs the leading plan and its relative cost for each variant, and warns
+    if even the cheapest is non-selective.
+
+    :param sf_connection: ``simple_salesforce.Salesforce`` connection
+    :param logger: structlog logger to log plan costs to
+    :param make_query: func taking a list of str date filter conditions and
+        returning the full SOQL query
+    :param date_field: str name of the date field the query must filter on
+    :param start_date: str earliest date, in SALESFORCE_DATETIME_FORMAT
+    :return: str name of the indexed field to add a filter on, None if the
+        query is cheapest as written, or False if no plan could be fetched
+    :rtype: str, None or bool
+    """
+    best_field = False
+    best_cost = best_query = None
+    for indexed_field in (None,) + INDEXED_DATE_FIELDS:
+        query = make_query(_date_filters(date_field, indexed_field, start_date))
+        plan = _explain(sf_connection, logger, query)
+        if plan is None:
+            continue
+
+        cost = plan["relativeCost"]
+        logger.info(
+            query_plan="cost",
+            sobject=plan.get("sobjectType"),
+            indexed_filter=indexed_field,
+            leading_operation=plan.get("leadingOperationType"),
+            relative_cost=cost,
+            cardinality=plan.get("cardinality"),
+        )
+        if best_cost is None or cost < best_cost:
+            best_field = indexed_field
+            best_cost = cost
+            best_query = query
+
+    if best_cost is not None and best_cost > SELECTIVE_COST_THRESHOLD:
+        logger.warn(
+            query_plan="non-selective",
+            indexed_filter=best_field,
+            relative_cost=best_cost,
+            query=best_query,
+        )
+
+    return best_field
+
+
+def _explain(sf_connection, logger, query):
+    """Fetch the leading (cheapest) plan for a query from the explain
+    endpoint.
+
+    Plan checking is only an optimization, so any failure to get a usable
+    plan is logged and treated as no plan rather than raised.
+
+    :param sf_connection: ``simple_salesforce.Salesforce`` connection
+    :param logger: structlog logger to log failures to
+    :param query: str SOQL query
+    :return: plan dict with a numeric relativeCost, or None if no usable plan
+        was returned
+    :rtype: dict or None
+    """
+    try:
+        result = sf_connection.restful("query/", params={"explain": query})
+        # plans come back sorted by relativeCost, cheapest first
+        plan = result["plans"][0]
+        cost = plan.get("relativeCost")
+    except Exception as e:
+        logger.warn(query_plan="explain failed", query=query, errors=repr(e))
+        return None
+
+    if isinstance(cost, bool) or not isinstance(cost, (int, float)):
+        logger.warn(
+            query_plan="explain failed", query=query, errors="no relativeCost"
+        )
+        return None
+
+    return plan
@@ -1,14 +1,20 @@
 """
 conftest.py
 
-Disable requests.request and logging.
+Put the repo root on sys.path, and disable requests.request and logging.
 """
 
 import logging
+from os import path
+import sys
 
 import pytest
 
 
+# src is imported as a package, as by cli.py and lambda_function.py
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+
 ## ensure no requests calls (used by simple_salesforce)
 @pytest.fixture(scope="function", autouse=True)
 def no_requests(monkeypatch):
@@ -11,7 +11,7 @@ from unittest.mock import (
 import pytest
 from simple_salesforce import Salesforce
 
-from convert_activity_histories import (
+from src.convert_activity_histories import (
     convert_activity_histories,
     convert_events,
     _group_records,
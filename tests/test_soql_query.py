@@ -0,0 +1,203 @@
+"""
+test_soql_query.py
+"""
+
+from unittest.mock import (
+    MagicMock,
+    Mock,
+)
+
+import pytest
+from simple_salesforce import (
+    Salesforce,
+    SalesforceError,
+)
+
+from salesforce_fields import activity_history as ah_fields
+from salesforce_fields import event as event_fields
+
+from src import convert_activity_histories
+from src import soql_query
+from src.soql_query import (
+    build_query,
+    planned_query,
+    LAST_MODIFIED_DATE,
+    SYSTEM_MODSTAMP,
+)
+
+
+START_DATE_FOR_TEST = "2017-12-02T00:00:00+0000"
+
+# relativeCost of the leading plan, by indexed filter added to the query
+plan_costs = {
+    None: 2.4,
+    SYSTEM_MODSTAMP: 0.3,
+    LAST_MODIFIED_DATE: 0.5,
+}
+
+
+def make_test_query(date_filters):
+    return build_query("Event", ["Id", "WhoId"], date_filters + ["WhoId != NULL"])
+
+
+def explain_result(path, params):
+    query = params["explain"]
+    for field in (SYSTEM_MODSTAMP, LAST_MODIFIED_DATE):
+        if field in query:
+            cost = plan_costs[field]
+            break
+    else:
+        cost = plan_costs[None]
+    return {"plans": [{
+        "sobjectType": "Event",
+        "leadingOperationType": "Index" if cost < 1 else "TableScan",
+        "relativeCost": cost,
+        "cardinality": 10,
+    }]}
+
+
+@pytest.fixture()
+def mock_salesforce_for_explain():
+    connection = MagicMock(spec=Salesforce)
+    connection.restful = MagicMock(side_effect=explain_result)
+    return connection
+
+
+@pytest.fixture(autouse=True)
+def empty_plan_cache(monkeypatch):
+    monkeypatch.setattr(soql_query, "_plan_cache", {})
+
+
+class TestSOQLQuery():
+
+    def test_build_query(self):
+        query = build_query(
+            "Event",
+            ["Id", "WhoId"],
+            ["WhoId != NULL", "OwnerId = 'abc123'"],
+            order_by=["WhoId", "CreatedDate"],
+        )
+        assert query == (
+            "SELECT Id, WhoId FROM Event "
+            "WHERE WhoId != NULL AND OwnerId = 'abc123' "
+            "ORDER BY WhoId, CreatedDate ASC "
+        )
+
+
+    def test_planned_query_adds_cheapest_indexed_filter(
+            self, mock_salesforce_for_explain):
+        logger = Mock()
+        query = planned_query(
+            mock_salesforce_for_explain, logger, make_test_query,
+            "CreatedDate", START_DATE_FOR_TEST,
+        )
+        assert f"CreatedDate >= {START_DATE_FOR_TEST}" in query
+        assert f"{SYSTEM_MODSTAMP} >= {START_DATE_FOR_TEST}" in query
+        assert LAST_MODIFIED_DATE not in query
+        assert logger.info.call_count == len(plan_costs)
+        logger.warn.assert_not_called()
+
+
+    def test_planned_query_caches_plan_per_shape(
+            self, mock_salesforce_for_explain):
+        logger = Mock()
+        first = planned_query(
+            mock_salesforce_for_explain, logger, make_test_query,
+            "CreatedDate", START_DATE_FOR_TEST,
+        )
+        explain_calls = mock_salesforce_for_explain.restful.call_count
+        second = planned_query(
+            mock_salesforce_for_explain, logger, make_test_query,
+            "CreatedDate", START_DATE_FOR_TEST,
+        )
+        assert first == second
+        assert mock_salesforce_for_explain.restful.call_count == explain_calls
+
+
+    def test_planned_query_warns_when_non_selective(
+            self, monkeypatch, mock_salesforce_for_explain):
+        monkeypatch.setitem(plan_costs, SYSTEM_MODSTAMP, 3.0)
+        monkeypatch.setitem(plan_costs, LAST_MODIFIED_DATE, 3.0)
+        logger = Mock()
+        query = planned_query(
+            mock_salesforce_for_explain, logger, make_test_query,
+            "CreatedDate", START_DATE_FOR_TEST,
+        )
+        assert SYSTEM_MODSTAMP not in query
+        logger.warn.assert_called_once()
+
+
+    @pytest.mark.parametrize("explain", [
+        Mock(side_effect=SalesforceError("url", 400, "Event", "bad query")),
+        Mock(side_effect=ConnectionError("connection reset")),
+        Mock(return_value={"plans": []}),
+        Mock(return_value={"plans": [{"sobjectType": "Event"}]}),
+        Mock(return_value={"plans": [{"relativeCost": "cheap"}]}),
+        Mock(return_value=["junk"]),
+        MagicMock(),
+    ])
+    def test_planned_query_runs_as_written_without_plan(self, explain):
+        connection = MagicMock(spec=Salesforce)
+        connection.restful = explain
+        logger = Mock()
+        query = planned_query(
+            connection, logger, make_test_query,
+            "CreatedDate", START_DATE_FOR_TEST,
+        )
+        assert query == make_test_query(
+            [f"CreatedDate >= {START_DATE_FOR_TEST}"]
+        )
+        assert soql_query._plan_cache == {}
+        logger.warn.assert_called()
+
+
+    def test_convert_events_query(self, monkeypatch,
+                                  mock_salesforce_for_explain):
+        salesforce_gen = Mock(return_value=[])
+        monkeypatch.setattr(
+            convert_activity_histories, "salesforce_gen", salesforce_gen
+        )
+        monkeypatch.setattr(
+            convert_activity_histories, "logger", Mock(), raising=False
+        )
+        convert_activity_histories.convert_events(
+            mock_salesforce_for_explain, START_DATE_FOR_TEST
+        )
+        mock_salesforce_for_explain.restful.assert_called()
+        salesforce_gen.assert_called_once_with(
+            mock_salesforce_for_explain,
+            f"SELECT {event_fields.ID}, {event_fields.WHO_ID}, "
+            f"{event_fields.SUBJECT}, {event_fields.DESCRIPTION}, "
+            f"{event_fields.START_DATETIME} "
+            f"FROM {event_fields.API_NAME} "
+            f"WHERE {event_fields.CREATED_DATE} >= {START_DATE_FOR_TEST} "
+            f"AND {SYSTEM_MODSTAMP} >= {START_DATE_FOR_TEST} "
+            f"AND {event_fields.WHO_ID} != NULL "
+            f"AND OwnerId = '{convert_activity_histories.AC_ID}' "
+            f"ORDER BY {event_fields.CREATED_DATE} ASC ",
+        )
+
+
+    def test_convert_activity_histories_query_not_planned(
+            self, monkeypatch, mock_salesforce_for_explain):
+        salesforce_gen = Mock(
+            return_value=iter([{"ActivityHistories": None}])
+        )
+        monkeypatch.setattr(
+            convert_activity_histories, "salesforce_gen", salesforce_gen
+        )
+        monkeypatch.setattr(
+            convert_activity_histories, "logger", Mock(), raising=False
+        )
+        convert_activity_histories.convert_activity_histories(
+            mock_salesforce_for_explain, START_DATE_FOR_TEST
+        )
+        # explain only sees the parent Account lookup, so isn't called
+        mock_salesforce_for_explain.restful.assert_not_called()
+        query = salesforce_gen.call_args[0][1]
+        assert query.startswith(f"SELECT (SELECT {ah_fields.ID}, ")
+        assert (
+            f"{ah_fields.CREATED_DATE} >= {START_DATE_FOR_TEST} "
+            f"ORDER BY {ah_fields.WHO_ID}, {ah_fields.CREATED_DATE} ASC)"
+        ) in query
+        assert SYSTEM_MODSTAMP not in query